@@ -1,30 +1,46 @@
-import re
+import asyncio
+import hmac
+import logging
+import os
+import shutil
 from datetime import datetime, timezone
 from random import randint
-from typing import Annotated, Any, Literal
+from typing import Annotated, Any, BinaryIO, Callable, Literal
 
-import aiofiles
-import aiofiles.os
+from cachetools import TTLCache
 from fastapi import Depends, FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.security import APIKeyHeader
-from google.api_core.exceptions import NotFound
 from google.cloud import firestore
-from pydantic import BaseModel, Field, NonNegativeInt
-from thefuzz import fuzz
+from pydantic import BaseModel, ConfigDict, Field, NonNegativeInt
+from rapidfuzz import fuzz, utils
+
+logger = logging.getLogger(__name__)
 
 # used to authenticate access to restricted parts of this api
 key_header = APIKeyHeader(name="x-ayrj-key", auto_error=False)
 KEY = ""  # protect at all cost. if this leaks, we have lost everything
 
-# regex to match doi urls so that they can be automatically extracted
-# this is not foul-proof, there is no way to check if the matched url is valid without actually requesting doi.org
-MATCH_DOI = re.compile("10\\.[\\.0-9]+/\\S*\\w")
-
 # file path for mounted gcloud storage FUSE
 DOCS_PATH = "/ayrj-docs"
 
+# file extensions of the document types that papers can be submitted as
+EXTENSIONS = {
+    "application/msword": ".doc",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
+    "application/pdf": ".pdf",
+}
+
+# number of streamed papers that are scored together in a worker thread when searching
+SEARCH_BATCH_SIZE = 32
+
+# firestore accepts at most 500 writes in a single batch
+REINDEX_BATCH_SIZE = 500
+
+# uploads are copied to storage in chunks of this many bytes instead of being read into memory whole
+UPLOAD_CHUNK_SIZE = 1 << 20
+
 db = firestore.AsyncClient(project="ayrj-backend")
 
 # use the same collection id so that all papers can be searched with a collection group query
@@ -43,6 +59,41 @@ featured = db.collection("featured")
 
 newsletter = db.collection("news")
 
+# holds the next document id to hand out, so that concurrent submissions can never get the same id
+id_counter = db.collection("counters").document("document-id")
+
+# ids of the documents in storage when this process started, loaded once so new ids can be checked without I/O
+# ids handed out by `id_counter` never collide with each other, so only these older ids need checking
+# stays `None` if storage could not be listed, then every new id is checked against storage directly instead
+existing_ids: set[str] | None = None
+
+# recent results of public listings, cleared whenever a published or retracted paper changes
+listing_cache: TTLCache = TTLCache(maxsize=128, ttl=60)
+
+# incremented whenever `listing_cache` is cleared, so listings that were already running do not cache outdated results
+listing_generation = 0
+
+
+def is_key_valid(key: str | None) -> bool:
+    """Compares `key` against `KEY` in constant time"""
+
+    return key is not None and hmac.compare_digest(key.encode(), KEY.encode())
+
+
+async def verify_key(key: str | None = Depends(key_header)) -> None:
+    """Dependency that rejects requests without a valid `x-ayrj-key` header"""
+
+    if not is_key_valid(key):
+        raise HTTPException(401)
+
+
+def invalidate_listings() -> None:
+    """Clears `listing_cache` and stops listings that are still running from caching their results"""
+
+    global listing_generation
+    listing_generation += 1
+    listing_cache.clear()
+
 
 def format_id_to_string(id: int) -> str:
     """Returns string of `id` padded with `0`s on the left until 9 digits long and then split every 3 digits with a `-`"""
@@ -66,17 +117,73 @@ def generate_author_shorthand(authors: list[str]) -> str:
             return f"{authors[0]} et al"
 
 
+def paper_shorthand(paper: dict[str, Any]) -> str:
+    """Returns the stored author shorthand of `paper`, or generates it for papers stored without one"""
+
+    return paper.get("shorthand") or generate_author_shorthand(paper["authors"])
+
+
+def copy_file(source: BinaryIO, path: str) -> None:
+    """Copies the whole of the open file `source` to `path` chunk by chunk"""
+
+    source.seek(0)
+    with open(path, "wb") as file:
+        shutil.copyfileobj(source, file, UPLOAD_CHUNK_SIZE)
+
+
+async def save_upload(upload: UploadFile, path: str) -> None:
+    """Copies `upload` to `path` and closes the temp file"""
+
+    # copy in a single worker thread instead of one thread pool round trip per file operation
+    await asyncio.to_thread(copy_file, upload.file, path)
+    await upload.close()
+
+
+def truncate_file(path: str) -> None:
+    """Removes all data from the file at `path` but leaves the file itself"""
+
+    open(path, "wb").close()
+
+
+@firestore.async_transactional
+async def increment_id_counter(transaction: firestore.AsyncTransaction) -> int:
+    """Returns the current value of `id_counter` and increments it"""
+
+    counter = await id_counter.get(transaction=transaction)
+
+    # seed the counter at a random offset the first time it is used, so ids do not start at `000-000-000`
+    # leave room for 100 million ids before they would need more than 9 digits
+    id = counter.get("next") if counter.exists else randint(0, 899_999_999)
+    transaction.set(id_counter, {"next": id + 1})
+
+    return id
+
+
+def generate_search_blob(
+    title: str, abstract: str, authors: list[str], references: list[str]
+) -> str:
+    """Returns all the searchable text of a paper joined and processed for fuzzy matching"""
+
+    return utils.default_process("\n".join([title, abstract, *references, *authors]))
+
+
+async def is_id_taken(code: str) -> bool:
+    """Returns whether a document with id `code` was stored before `id_counter` existed"""
+
+    if existing_ids is not None:
+        return code in existing_ids
+
+    return await asyncio.to_thread(os.path.exists, f"{DOCS_PATH}/papers/{code}")
+
+
 async def generate_unique_document_id() -> str:
-    """Generate a unique id by hashing the document contents and linear probing to avoid collisions"""
+    """Generate a unique id by atomically incrementing a counter in firestore"""
 
-    # generate (hopefully) unique id
-    id = randint(0, 999_999_999)
-    code = format_id_to_string(id)
+    code = format_id_to_string(await increment_id_counter(db.transaction()))
 
-    # check if the id is already used, increment it until it is no longer in use
-    while await aiofiles.os.path.exists(f"{DOCS_PATH}/papers/{code}"):
-        id = randint(0, 999_999_999)
-        code = format_id_to_string(id)
+    # ids used to be generated randomly, so skip any that were already taken before the counter existed
+    while await is_id_taken(code):
+        code = format_id_to_string(await increment_id_counter(db.transaction()))
 
     return code
 
@@ -87,22 +194,35 @@ async def move_document(
     document_id: str,
     from_collection: firestore.AsyncCollectionReference,
     to_collection: firestore.AsyncCollectionReference,
-) -> dict[str, Any]:
+    precondition: Callable[[dict[str, Any]], None] | None = None,
+    mutate: Callable[[dict[str, Any]], dict[str, Any]] | None = None,
+) -> None:
+    """Moves a document between collections in one transaction
+    `precondition` may raise to abort, `mutate` returns the document to write instead"""
+
     doc_ref = from_collection.document(document_id)
     document = await doc_ref.get(transaction=transaction)
+    # raised as a 404 here since the transaction itself raises `ValueError` once it runs out of retries
     if not document.exists:
-        raise ValueError(
-            f"Document with id `{document_id}` does not exist in the specified collection"
+        raise HTTPException(
+            404,
+            f"Document with id `{document_id}` does not exist in `{from_collection.parent.id}` collection",
         )
 
     doc_dict = document.to_dict()
+
+    if precondition is not None:
+        precondition(doc_dict)
+    if mutate is not None:
+        doc_dict = mutate(doc_dict)
+
     transaction.set(to_collection.document(document_id), doc_dict)
     transaction.delete(doc_ref)
 
-    return doc_dict
-
 
 class Correction(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     id: str
 
     date: datetime
@@ -112,6 +232,9 @@ class Correction(BaseModel):
 
 
 class Paper(BaseModel):
+    # extra keys are left ignored rather than forbidden, forbidding them makes pydantic check every key of the input instead of only the declared fields
+    model_config = ConfigDict(frozen=True)
+
     id: str
 
     title: str
@@ -134,19 +257,133 @@ class Paper(BaseModel):
     icon_names: list[str] = []
 
 
-app = FastAPI()
+# only request the fields of `Paper` from firestore, not the search and naming fields stored alongside it
+PAPER_FIELDS = list(Paper.model_fields)
+
+
+def paper_matches(contains: str, paper: dict[str, Any], quality_limit: int) -> bool:
+    """Returns whether `contains` fuzzy matches any of the searchable fields of the stored `paper`
+    `contains` should already be processed with `utils.default_process`"""
+
+    # the search blob holds all the searchable fields, joined and processed when the paper was written
+    # so the query is scored once against all of them instead of once per title, abstract and reference
+    # a query made of a whole title or author name plus other words fully matches that field on its own, but not the longer blob
+    # so the title and each author are still scored separately, like they were before the blob existed
+    texts = [
+        paper.get("search_blob", ""),
+        *map(
+            utils.default_process, [paper.get("title", ""), *paper.get("authors", [])]
+        ),
+    ]
+
+    # `score_cutoff` lets rapidfuzz give up early once `quality_limit` can no longer be reached
+    # thefuzz rounded scores to whole numbers, so scores that round up to `quality_limit` still match
+    return any(
+        round(fuzz.partial_ratio(contains, text, score_cutoff=quality_limit - 0.5))
+        >= quality_limit
+        for text in texts
+    )
+
+
+def filter_papers(
+    contains: str, snapshots: list[firestore.DocumentSnapshot], quality_limit: int
+) -> list[firestore.DocumentSnapshot]:
+    """Returns the `snapshots` that match `contains`, meant to be run in a worker thread"""
+
+    return [
+        paper
+        for paper in snapshots
+        if paper_matches(contains, paper.to_dict(), quality_limit)
+    ]
+
+
+async def search_papers(
+    listing: firestore.AsyncQuery, contains: str, length: int, quality_limit: int
+) -> list[Paper]:
+    """Returns the first `length` papers in `listing` that match `contains`"""
+
+    matches = []
+    batch = []
+
+    # only stream the fields to filter with, the full papers are fetched for the matches afterwards
+    async for paper in listing.select(["search_blob", "title", "authors"]).stream():
+        batch.append(paper)
+
+        # score as soon as the batch could hold every match still needed, so short listings do not wait on extra papers
+        if len(batch) < min(SEARCH_BATCH_SIZE, length - len(matches)):
+            continue
+
+        matches += await asyncio.to_thread(
+            filter_papers, contains, batch, quality_limit
+        )
+        batch = []
+        if len(matches) >= length:
+            break
+    else:
+        # the stream ran out before the last batch was full
+        matches += await asyncio.to_thread(
+            filter_papers, contains, batch, quality_limit
+        )
+
+    refs = [paper.reference for paper in matches[:length]]
+    if not refs:
+        return []
+
+    # `get_all` returns the papers in any order, so put them back in listing order
+    found = {
+        paper.reference.path: paper async for paper in db.get_all(refs, PAPER_FIELDS)
+    }
+
+    # only validate the papers that are actually returned
+    return [
+        Paper.model_validate(found[ref.path].to_dict())
+        for ref in refs
+        if found[ref.path].exists
+    ]
+
+
+# orjson serialises the paper listings, including their datetimes, much faster than the standard json module
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]
 )
 
 
+@app.on_event("startup")
+async def warm_up() -> None:
+    """Opens the firestore channel before the first request so that it does not pay for the connection setup"""
+
+    # only an optimisation, so the api still starts if firestore cannot be reached yet
+    try:
+        await published.select([]).limit(1).get()
+    except Exception:
+        logger.warning("Could not warm up the firestore channel", exc_info=True)
+
+
+@app.on_event("startup")
+async def load_existing_ids() -> None:
+    """Lists the stored documents once so that generating ids does not need to probe storage"""
+
+    global existing_ids
+
+    # storage is not mounted when running locally, so fall back to checking each new id instead of failing
+    try:
+        existing_ids = set(await asyncio.to_thread(os.listdir, f"{DOCS_PATH}/papers"))
+    except OSError:
+        logger.warning(
+            "Could not list `%s/papers`, generated ids are checked against storage one at a time",
+            DOCS_PATH,
+            exc_info=True,
+        )
+
+
 @app.get("/")
 async def welcome() -> str:
     return "Welcome to the AYRJ backend API"
 
 
-@app.post("/submit")
+@app.post("/submit", dependencies=[Depends(verify_key)])
 async def submit(
     title: str = Form(),
     abstract: str = Form(),
@@ -155,26 +392,17 @@ async def submit(
     references: list[str] = Form(),
     doc: UploadFile = File(),
     icons: list[UploadFile] = File([]),
-    key: str = Depends(key_header),
 ) -> str:
     """Handles initialising all paper data and adding it to the `reviewing` collection"""
 
-    if key != KEY:
-        raise HTTPException(401)
-
     # get file extension and check if its a valid file type
-    match doc.content_type:
-        case "application/msword":
-            extension = ".doc"
-        case "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            extension = ".docx"
-        case "application/pdf":
-            extension = ".pdf"
-        case _:
-            raise HTTPException(
-                415,
-                f"Upload `.pdf`, `.doc` or `.docx` files only, not `{doc.content_type}`",
-            )
+    try:
+        extension = EXTENSIONS[doc.content_type]
+    except KeyError:
+        raise HTTPException(
+            415,
+            f"Upload `.pdf`, `.doc` or `.docx` files only, not `{doc.content_type}`",
+        )
 
     # validate that all uploaded images are pngs
     if not all(ico.content_type == "image/png" for ico in icons):
@@ -188,72 +416,64 @@ async def submit(
 
     code = await generate_unique_document_id()
 
-    # save the document and close the temp file
-    async with aiofiles.open(f"{DOCS_PATH}/papers/{code}", "wb") as file:
-        await file.write(await doc.read(-1))
-    await doc.close()
-
-    for i, icon in enumerate(icons):
-        async with aiofiles.open(f"{DOCS_PATH}/images/{code}-{i+1}", "wb") as file:
-            await file.write(await icon.read(-1))
-        await icon.close()
-
     # create the `Paper` object, using pydantic parser to enforce type checking
-    # then upload it to firestore
-    await reviewing.document(code).set(
-        Paper(
-            id=code,
-            title=title,
-            abstract=abstract,
-            authors=authors,
-            category=category,
-            references=references,
-            submitted=datetime.now(tz=timezone.utc),
-            document_name=f"{shorthand} DRAFT{extension}",
-            document_mimetype=doc.content_type,
-            icon_names=[ico.filename for ico in icons],
-        ).model_dump()
+    paper = Paper(
+        id=code,
+        title=title,
+        abstract=abstract,
+        authors=authors,
+        category=category,
+        references=references,
+        submitted=datetime.now(tz=timezone.utc),
+        document_name=f"{shorthand} DRAFT{extension}",
+        document_mimetype=doc.content_type,
+        icon_names=[ico.filename for ico in icons],
+    ).model_dump() | {
+        "search_blob": generate_search_blob(title, abstract, authors, references),
+        "shorthand": shorthand,
+    }
+
+    # save the document and icons, closing their temp files, while uploading the paper to firestore
+    await asyncio.gather(
+        save_upload(doc, f"{DOCS_PATH}/papers/{code}"),
+        *(
+            save_upload(icon, f"{DOCS_PATH}/images/{code}-{i+1}")
+            for i, icon in enumerate(icons)
+        ),
+        reviewing.document(code).set(paper),
     )
 
     # return the id of the paper under review
     return code
 
 
-@app.patch("/publish")
-async def publish(id: str, key: str = Depends(key_header)) -> None:
+@app.patch("/publish", dependencies=[Depends(verify_key)])
+async def publish(id: str) -> None:
     """Moves paper from `reviewing` to `published` collection"""
 
-    if key != KEY:
-        raise HTTPException(401)
-
-    paper = await reviewing.document(id).get(["document_mimetype", "authors"])
-
-    if not paper.exists:
-        raise HTTPException(
-            404, f"Document with id {id} does not exist in `reviewing` collection"
-        )
+    now = datetime.now(tz=timezone.utc)
 
-    if paper.get("document_mimetype") != "application/pdf":
-        raise HTTPException(415, "Change paper document to pdf before publication")
+    def check_pdf(paper: dict[str, Any]) -> None:
+        if paper["document_mimetype"] != "application/pdf":
+            raise HTTPException(415, "Change paper document to pdf before publication")
 
-    now = datetime.now(tz=timezone.utc)
-    await reviewing.document(id).update(
-        {
+    def stamp_published(paper: dict[str, Any]) -> dict[str, Any]:
+        return paper | {
             "published": now,
-            "document_name": f"{generate_author_shorthand(paper.get('authors'))} ({now.strftime('%Y')}).pdf",
+            "document_name": f"{paper_shorthand(paper)} ({now.year}).pdf",
         }
-    )
 
-    await move_document(db.transaction(), id, reviewing, published)
+    # check, stamp and move the paper in a single transaction instead of a separate read and update first
+    await move_document(
+        db.transaction(), id, reviewing, published, check_pdf, stamp_published
+    )
+    invalidate_listings()
 
 
-@app.delete("/reject")
-async def reject(id: str, key: str = Depends(key_header)) -> None:
+@app.delete("/reject", dependencies=[Depends(verify_key)])
+async def reject(id: str) -> None:
     """Removes paper data from `paper-data` collection and documents from gcloud storage"""
 
-    if key != KEY:
-        raise HTTPException(401)
-
     paper_ref = reviewing.document(id)
     paper = await paper_ref.get(["icon_names"])
 
@@ -263,13 +483,13 @@ async def reject(id: str, key: str = Depends(key_header)) -> None:
         )
 
     for i in range(len(paper.get("icon_names"))):
-        await aiofiles.os.remove(f"{DOCS_PATH}/images/{id}-{i+1}")
+        await asyncio.to_thread(os.remove, f"{DOCS_PATH}/images/{id}-{i+1}")
 
     await paper_ref.delete()
-    await aiofiles.os.remove(f"{DOCS_PATH}/papers/{id}")
+    await asyncio.to_thread(os.remove, f"{DOCS_PATH}/papers/{id}")
 
 
-@app.patch("/review")
+@app.patch("/review", dependencies=[Depends(verify_key)])
 async def review(
     id: str = Form(),
     title: str = Form(None),
@@ -278,156 +498,164 @@ async def review(
     category: str = Form(None),
     references: list[str] = Form(None),
     doc: UploadFile = File(None),
-    key: str = Depends(key_header),
 ) -> None:
     """Updates paper in `reviewing` collection"""
 
-    if key != KEY:
-        raise HTTPException(401)
-
     paper_ref = reviewing.document(id)
-    paper = await paper_ref.get(["authors", "title", "abstract", "references"])
+    paper = await paper_ref.get(
+        ["authors", "title", "abstract", "references", "shorthand"]
+    )
 
     if not paper.exists:
         raise HTTPException(
             404, f"Document with id `{id}` does not exist in `reviewing` collection"
         )
 
-    update_dict = {}
+    # only update the fields that were given
+    update_dict = {
+        field: value
+        for field, value in (
+            ("title", title),
+            ("abstract", abstract),
+            ("authors", authors),
+            ("category", category),
+            ("references", references),
+        )
+        if value
+    }
+
+    if authors:
+        update_dict["shorthand"] = generate_author_shorthand(authors)
 
     if doc is not None:
-        match doc.content_type:
-            case "application/msword":
-                extension = ".doc"
-            case "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-                extension = ".docx"
-            case "application/pdf":
-                extension = ".pdf"
-            case _:
-                raise HTTPException(415, "Upload `.pdf`, `.doc` or `.docx` files only")
-
-        async with aiofiles.open(f"{DOCS_PATH}/papers/{id}", "wb") as file:
-            await file.write(await doc.read(-1))
-        await doc.close()
-
-        update_dict |= {
-            "document_name": f"{generate_author_shorthand(paper.get('authors'))} DRAFT.{extension}",
-            "document_mimetype": doc.content_type,
-        }
+        try:
+            extension = EXTENSIONS[doc.content_type]
+        except KeyError:
+            raise HTTPException(
+                415,
+                f"Upload `.pdf`, `.doc` or `.docx` files only, not `{doc.content_type}`",
+            )
 
-    if title:
-        update_dict |= {"title": title}
-    if abstract:
-        update_dict |= {"abstract": abstract}
-    if authors:
-        update_dict |= {"authors": authors}
-    if category:
-        update_dict |= {"category": category}
-    if references:
-        update_dict |= {"references": references}
-
-    if update_dict or doc:
-        await paper_ref.update(
-            update_dict
-            | {
-                "reviewed": firestore.ArrayUnion([datetime.now(tz=timezone.utc)]),
-            }
+        # reuse the stored shorthand unless the authors are being changed
+        shorthand = update_dict.get("shorthand") or paper_shorthand(paper.to_dict())
+        update_dict["document_name"] = f"{shorthand} DRAFT{extension}"
+        update_dict["document_mimetype"] = doc.content_type
+
+    # keep the stored search fields in sync with the updated paper
+    if title or abstract or authors or references:
+        update_dict["search_blob"] = generate_search_blob(
+            title or paper.get("title"),
+            abstract or paper.get("abstract"),
+            authors or paper.get("authors"),
+            references or paper.get("references"),
         )
 
+    if update_dict:
+        writes = [
+            paper_ref.update(
+                update_dict
+                | {
+                    "reviewed": firestore.ArrayUnion([datetime.now(tz=timezone.utc)]),
+                }
+            )
+        ]
+        # the new document does not depend on the firestore update, so save both concurrently
+        if doc is not None:
+            writes.append(save_upload(doc, f"{DOCS_PATH}/papers/{id}"))
+
+        await asyncio.gather(*writes)
+
 
-@app.patch("/retract")
-async def retract(id: str, key: str = Depends(key_header)) -> None:
+@app.patch("/retract", dependencies=[Depends(verify_key)])
+async def retract(id: str) -> None:
     """Moves paper from `published` collection to `retracted` collection
     Retracts paper but does not actually delete any data"""
 
-    if key != KEY:
-        raise HTTPException(401)
-
-    try:
-        await published.document(id).update(
-            {"retracted": datetime.now(tz=timezone.utc)}
-        )
-    except NotFound:
-        raise HTTPException(
-            404, f"Document with id `{id}` does not exist in `published` collection"
-        )
+    now = datetime.now(tz=timezone.utc)
 
-    await move_document(db.transaction(), id, published, retracted)
+    await move_document(
+        db.transaction(),
+        id,
+        published,
+        retracted,
+        mutate=lambda paper: paper | {"retracted": now},
+    )
+    invalidate_listings()
 
 
-@app.delete("/remove")
-async def remove(id: str, key: str = Depends(key_header)) -> None:
+@app.delete("/remove", dependencies=[Depends(verify_key)])
+async def remove(id: str) -> None:
     """Removes retracted paper data from `retracted` collection and truncates files in google cloud storage"""
 
-    if key != KEY:
-        raise HTTPException(401)
-
     paper_ref = retracted.document(id)
-    paper = await paper_ref.get(["corrected"])
+    paper = await paper_ref.get(["corrected", "icon_names"])
     if not paper.exists:
         raise HTTPException(
             404, f"Document with id `{id}` does not exist in `retracted` collection"
         )
 
-    await paper_ref.delete()
-
-    for correction in paper.get("corrected"):
-        correction_id = correction["id"]
-        # remove all document data but leave the document name, this will prevent retracted `id`s from being reused
-        async with aiofiles.open(f"{DOCS_PATH}/papers/{correction_id}", "wb") as _:
-            pass
-
-    for i in range(len(paper.get("icon_names"))):
+    # the paper data and all of its files are independent, so remove them all concurrently
+    await asyncio.gather(
+        paper_ref.delete(),
+        # remove all document data but leave the document names, this will prevent retracted `id`s from being reused
+        *(
+            asyncio.to_thread(truncate_file, f"{DOCS_PATH}/papers/{correction['id']}")
+            for correction in paper.get("corrected")
+        ),
+        asyncio.to_thread(truncate_file, f"{DOCS_PATH}/papers/{id}"),
         # safe to delete since id will never get re-used
-        await aiofiles.os.remove(f"{DOCS_PATH}/images/{id}-{i+1}")
-
-    # remove all document data but leave the document name, this will prevent retracted `id`s from being reused
-    async with aiofiles.open(f"{DOCS_PATH}/papers/{id}", "wb") as _:
-        pass
+        *(
+            asyncio.to_thread(os.remove, f"{DOCS_PATH}/images/{id}-{i+1}")
+            for i in range(len(paper.get("icon_names")))
+        ),
+    )
+    invalidate_listings()
 
 
-@app.post("/correct")
+@app.post("/correct", dependencies=[Depends(verify_key)])
 async def correct(
     id: str = Form(),
     description: str = Form(),
     doc: UploadFile = File(),
-    key: str = Depends(key_header),
 ) -> str:
     "Adds a correction to a published paper"
 
-    if key != KEY:
-        raise HTTPException(401)
-
     if doc.content_type != "application/pdf":
         raise HTTPException(415, "Please upload only `.pdf` files")
 
     paper_ref = published.document(id)
-    paper = await paper_ref.get(["authors", "corrected", "published"])
+
+    # reading the paper and generating the correction id are independent, so do both concurrently
+    # an id used up by a correction to a missing paper is simply skipped
+    paper, code = await asyncio.gather(
+        paper_ref.get(["authors", "shorthand", "corrected", "published"]),
+        generate_unique_document_id(),
+    )
     if not paper.exists:
         raise HTTPException(
             404, f"Document with id `{id}` does not exist in `published` collection"
         )
 
-    code = await generate_unique_document_id()
-
-    async with aiofiles.open(f"{DOCS_PATH}/papers/{code}", "wb") as file:
-        await file.write(await doc.read(-1))
-    await doc.close()
-
-    await paper_ref.update(
-        {
-            "corrected": firestore.ArrayUnion(
-                [
-                    Correction(
-                        id=code,
-                        date=datetime.now(tz=timezone.utc),
-                        description=description,
-                        document_name=f"{generate_author_shorthand(paper.get('authors'))} ({paper.get('published').strftime('%Y')}) Correction {len(paper.get('corrected'))+1}.pdf",
-                    ).model_dump()
-                ]
-            ),
-        },
+    # the correction document and the firestore update are independent, so save both concurrently
+    await asyncio.gather(
+        save_upload(doc, f"{DOCS_PATH}/papers/{code}"),
+        paper_ref.update(
+            {
+                "corrected": firestore.ArrayUnion(
+                    [
+                        # every field is built here, so write the `Correction` fields directly without validating them
+                        {
+                            "id": code,
+                            "date": datetime.now(tz=timezone.utc),
+                            "description": description,
+                            "document_name": f"{paper_shorthand(paper.to_dict())} ({paper.get('published').year}) Correction {len(paper.get('corrected'))+1}.pdf",
+                        }
+                    ]
+                ),
+            },
+        ),
     )
+    invalidate_listings()
 
     return code
 
@@ -452,15 +680,34 @@ async def list_papers(
             listing = retracted
             date = "retracted"
         case "reviewing":
-            if key != KEY:
+            if not is_key_valid(key):
                 raise HTTPException(401)
             listing = reviewing
             date = "submitted"
         case "all":
-            if key != KEY:
+            if not is_key_valid(key):
                 raise HTTPException(401)
             listing = db.collection_group("paper-data")
             date = "submitted"
+
+    # public listings are requested repeatedly with the same queries, so serve them from the cache when possible
+    cacheable = paper_type in ("published", "retracted")
+    cache_key = (
+        paper_type,
+        length,
+        start_at_id,
+        start_at_date,
+        end_before_date,
+        category,
+        contains,
+        quality_limit,
+    )
+    # look the entry up once, it could expire between a membership check and the read
+    cached = listing_cache.get(cache_key)
+    if cacheable and cached is not None:
+        return cached
+    generation = listing_generation
+
     listing = listing.order_by("id").order_by(date)
     if start_at_id is not None:
         listing = listing.start_at({"id": start_at_id})
@@ -478,30 +725,31 @@ async def list_papers(
             filter=firestore.FieldFilter(date, "<", end_before_date)
         )
 
-    out = []
-    out_len = 0
-
     if contains == "":
         quality_limit = 0
 
-    async for paper in listing.stream():
-        paper = Paper.model_validate(paper.to_dict())
+    # lowercase the query and replace its punctuation once instead of once per paper
+    # unlike thefuzz, which compared the raw strings, this makes searches case and punctuation insensitive
+    contains = utils.default_process(contains)
 
-        if (
-            fuzz.partial_ratio(contains, paper.title) >= quality_limit
-            or fuzz.partial_ratio(contains, paper.abstract) >= quality_limit
-            or fuzz.partial_ratio(contains, paper.references) >= quality_limit
-            or any(
-                fuzz.partial_ratio(author, contains) >= quality_limit
-                for author in paper.authors
-            )
-        ):
-            out.append(paper)
-            out_len += 1
-            if out_len >= length:
-                break
+    # a query with no letters or digits left after processing scores 0 against every paper
+    if contains == "" and quality_limit > 0:
+        return []
+
+    # every paper matches when there is no quality limit, so firestore only needs to send `length` of them
+    if quality_limit == 0:
+        results = [
+            Paper.model_validate(paper.to_dict())
+            async for paper in listing.limit(length).select(PAPER_FIELDS).stream()
+        ]
+    else:
+        results = await search_papers(listing, contains, length, quality_limit)
+
+    # a paper changed while this listing ran, so the result may already be outdated
+    if cacheable and generation == listing_generation:
+        listing_cache[cache_key] = results
 
-    return out
+    return results
 
 
 @app.get("/get/{paper_type}")
@@ -514,12 +762,12 @@ async def get_paper(
         case "published":
             collection = published
         case "reviewing":
-            if key != KEY:
+            if not is_key_valid(key):
                 raise HTTPException(401)
             collection = reviewing
         case "journal":
             path = f"{DOCS_PATH}/journals/{id}"
-            if not (await aiofiles.os.path.isfile(path)):
+            if not (await asyncio.to_thread(os.path.isfile, path)):
                 raise HTTPException(
                     404, "A publication with that id could not be found"
                 )
@@ -553,19 +801,13 @@ async def get_paper(
 
 @app.get("/num-papers")
 async def count_papers() -> int:
-    total = 0
+    # let firestore count the papers server side instead of streaming every document
+    result = await published.count().get()
+    return result[0][0].value
 
-    async for _ in published.select([]).stream():
-        total += 1
-
-    return total
-
-
-@app.put("/feature")
-async def feature(id: str, key: str = Depends(key_header)) -> None:
-    if key != KEY:
-        raise HTTPException(401)
 
+@app.put("/feature", dependencies=[Depends(verify_key)])
+async def feature(id: str) -> None:
     if not (await published.document(id).get([])).exists:
         raise HTTPException(
             404, f"Document with id `{id}` does not exist in `published` collection"
@@ -574,38 +816,40 @@ async def feature(id: str, key: str = Depends(key_header)) -> None:
     await featured.document(id).set({})
 
 
-@app.put("/unfeature")
-async def unfeature(id: str, key: str = Depends(key_header)) -> None:
-    if key != KEY:
-        raise HTTPException(401)
-
+@app.put("/unfeature", dependencies=[Depends(verify_key)])
+async def unfeature(id: str) -> None:
     await featured.document(id).delete()
 
 
 @app.get("/features")
 async def list_featured() -> list[Paper]:
-    # iterates through all the paper id in featured collection, requests for the paper data, and returns it
+    # collects all the paper ids in featured collection, requests for all the paper data at once, and returns it
+    # papers that are no longer published are skipped
+
+    refs = [published.document(paper_code.id) async for paper_code in featured.stream()]
+    if not refs:
+        return []
+
+    # `get_all` returns the papers in any order, so put them back in the order they were featured in
+    found = {
+        paper.reference.path: paper async for paper in db.get_all(refs, PAPER_FIELDS)
+    }
 
     return [
-        Paper.model_validate((await published.document(paper_code.id).get()).to_dict())
-        async for paper_code in featured.stream()
+        Paper.model_validate(found[ref.path].to_dict())
+        for ref in refs
+        if found[ref.path].exists
     ]
 
 
-@app.post("/journal")
-async def publish_journal(
-    title: str, doc: UploadFile, key: str = Depends(key_header)
-) -> None:
-    if key != KEY:
-        raise HTTPException(401)
+@app.post("/journal", dependencies=[Depends(verify_key)])
+async def publish_journal(title: str, doc: UploadFile) -> None:
     if doc.content_type != "application/pdf":
         raise HTTPException(415, "Please upload `.pdf` files only")
-    if await aiofiles.os.path.exists(f"{DOCS_PATH}/journals/{title}"):
+    if await asyncio.to_thread(os.path.exists, f"{DOCS_PATH}/journals/{title}"):
         raise HTTPException(422, "A publication with that title already exists")
 
-    async with aiofiles.open(f"{DOCS_PATH}/journals/{title}", "wb") as file:
-        await file.write(await doc.read(-1))
-    await doc.close()
+    await save_upload(doc, f"{DOCS_PATH}/journals/{title}")
 
 
 class NewsletterRecipientInfo(BaseModel):
@@ -618,13 +862,8 @@ async def newsletter_sign_up(info: NewsletterRecipientInfo) -> None:
     await newsletter.document(info.email).set(info.model_dump())
 
 
-@app.get("/recipients")
-async def news_letter_recipients(
-    key: str = Depends(key_header),
-) -> list[NewsletterRecipientInfo]:
-    if key != KEY:
-        raise HTTPException(401)
-
+@app.get("/recipients", dependencies=[Depends(verify_key)])
+async def news_letter_recipients() -> list[NewsletterRecipientInfo]:
     return [
         NewsletterRecipientInfo.model_validate(recipient.to_dict())
         async for recipient in newsletter.stream()
@@ -642,7 +881,7 @@ async def get_paper_icons(
         case "published":
             collection = published
         case "reviewing":
-            if key != KEY:
+            if not is_key_valid(key):
                 raise HTTPException(401)
             collection = reviewing
 
@@ -657,3 +896,54 @@ async def get_paper_icons(
         filename=paper.get("icon_names")[index],
         media_type="image/png",
     )
+
+
+@app.patch("/reindex", dependencies=[Depends(verify_key)])
+async def reindex() -> None:
+    """Recomputes the derived fields of every paper, for papers stored before those fields existed"""
+
+    batch = db.batch()
+    pending = 0
+    async for paper in (
+        db.collection_group("paper-data")
+        .select(["title", "abstract", "authors", "references"])
+        .stream()
+    ):
+        batch.update(
+            paper.reference,
+            {
+                "search_blob": generate_search_blob(
+                    paper.get("title"),
+                    paper.get("abstract"),
+                    paper.get("authors"),
+                    paper.get("references"),
+                ),
+                "shorthand": generate_author_shorthand(paper.get("authors")),
+            },
+        )
+
+        # commit in batches instead of waiting on one update per paper
+        pending += 1
+        if pending == REINDEX_BATCH_SIZE:
+            await batch.commit()
+            batch = db.batch()
+            pending = 0
+
+    if pending:
+        await batch.commit()
+
+    invalidate_listings()
+
+
+if __name__ == "__main__":
+    # only needed when run directly, so importing the app in a worker does not import it
+    import uvicorn
+
+    # uvloop and httptools are much faster than the default asyncio loop and h11 parser for uploads
+    uvicorn.run(
+        "main:app",
+        loop="uvloop",
+        http="httptools",
+        workers=2 * (os.cpu_count() or 1) + 1,
+        log_level="warning",
+    )